@@ -1,43 +1,138 @@
+import asyncio
+import functools
+import heapq
+import itertools
 import logging
+import os
 import re
 import sys
-from bs4 import BeautifulSoup
-from queue import Queue, PriorityQueue
-from urllib import parse, request
-
-logging.basicConfig(level=logging.DEBUG, filename='output.log', filemode='w')
+import aiohttp
+import requests
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from html import unescape
+from types import MappingProxyType
+from lxml import etree, html as lxml_html
+from requests.adapters import HTTPAdapter
+from urllib import parse
+
+try:
+    # google-re2 compiles patterns to a DFA instead of backtracking, which is much
+    # faster for scanning every crawled page; fall back to the standard library if absent
+    import re2 as _contact_re
+except ImportError:
+    _contact_re = re
+
+# delay opening the log until the first record so the parse/extract worker processes, which
+# import this module but never log, don't truncate it out from under the crawler
+logging.basicConfig(level=logging.DEBUG, handlers=[logging.FileHandler('output.log', mode='w', delay=True)])
 visitlog = logging.getLogger('visited')
 extractlog = logging.getLogger('extracted')
 
+CRAWL_WORKERS = 16 # number of pages fetched concurrently
+PER_HOST_CONNECTIONS = 4 # politeness limit on concurrent requests to one host
+REQUEST_TIMEOUT = 10 # seconds
+USER_AGENT = 'IR-WA-HW4 crawler'
+
+# keep-alive connection pool shared by every synchronous fetch, so repeated requests
+# to the same host skip the TCP and TLS handshakes
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+_SESSION.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+_SESSION.headers.update({'User-Agent': USER_AGENT})
+
+# media types only; parameters such as charset are stripped from the header before comparing
+CONTENT_TYPES = MappingProxyType({
+    'text': frozenset({'text/html', 'text/plain'}),
+    'html': frozenset({'text/html'}),
+    'pdf': frozenset({'application/pdf'}),
+    'zip': frozenset({'application/zip'}),
+    'jpeg': frozenset({'image/jpeg'}),
+    'png': frozenset({'image/png'}),
+    'pptx': frozenset({'application/vnd.ms-powerpoint',
+                       'application/vnd.openxmlformats-officedocument.presentationml.presentation'})
+})
+_HTTP_SCHEMES = frozenset({'http', 'https'})
+
+_WS_RE = re.compile(r'\s+')
+# the inside of a tag; quoted attribute values are consumed whole so a '>' inside one doesn't end the tag
+_TAG_BODY = rb'(?:[^>"\']|"[^"]*"|\'[^\']*\')*'
+_HREF_RE = re.compile(
+    rb'<a\b' + _TAG_BODY + rb'?\shref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))' + _TAG_BODY + rb'>(.*?)</a>',
+    re.IGNORECASE | re.DOTALL
+)
+_TAG_RE = re.compile(rb'<' + _TAG_BODY + rb'>')
+# start of an <a> tag that has an href to match; plain <a name>/<a id>/<a onclick> tags aren't counted
+_ANCHOR_RE = re.compile(rb'<a\b' + _TAG_BODY + rb'?\shref\s*=', re.IGNORECASE)
+# markup whose <a> tags and hrefs aren't real links
+_IGNORED_RE = re.compile(rb'<!--.*?-->|<script\b.*?</script\s*>|<style\b.*?</style\s*>', re.IGNORECASE | re.DOTALL)
+
+# All contact patterns are combined into one alternation so a page's text is only scanned once;
+# the name of the group that matched tells us which category the match belongs to.
+# Like _HREF_RE it works on the raw response bytes, so a page never has to be decoded as a whole.
+# PHONE2 accounts for other formating.
+# For EMAIL, hypens, periods, and underscores are all valid special characters besides alphanumerics
+# for an email's username and domain; domain extension must contain a '.' followed by a 2-3 digit
+# long sequence, e.g., '.us' '.edu'
+_CONTACT = _contact_re.compile(
+    rb'(?P<PHONE1>\d{3}-\d{3}-\d{4})'
+    rb'|(?P<PHONE2>\(\d{3}\) \d{3}-\d{4})'
+    rb'|(?P<EMAIL>[a-zA-Z0-9_\-.]+@[a-zA-Z0-9_\-.]+\.[a-zA-Z]{2,3})'
+    rb'|(?P<ADDRESS>[a-zA-Z]+ ?[a-zA-Z]+?, [a-zA-Z.]+ [0-9]{5})'
+)
+_GROUP_CATEGORIES = {
+    'PHONE1': 'PHONE',
+    'PHONE2': 'PHONE',
+    'EMAIL': 'EMAIL',
+    'ADDRESS': 'ADDRESS'
+}
+# keyed by group number, since re2 reports group names of a bytes pattern as bytes while re uses str
+_CONTACT_CATEGORIES = {
+    index: _GROUP_CATEGORIES[name.decode('ascii') if isinstance(name, bytes) else name]
+    for name, index in _CONTACT.groupindex.items()
+}
+
 
 def parse_links(root, html):
-    soup = BeautifulSoup(html, 'html.parser')
-    for link in soup.find_all('a'):
-        href = link.get('href')
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    elif not html.isascii():
+        try:
+            html.decode('utf-8')
+        except UnicodeDecodeError:
+            # some other charset (e.g. latin-1); lxml decodes using the one the page declares
+            yield from _parse_links_lxml(root, html)
+            return
+
+    # a link is all that's needed from the page, so find the <a> tags with a regex instead of parsing
+    # the whole document; the link text is whatever is left once any nested tags are removed
+    markup = _IGNORED_RE.sub(b'', html)
+    matches = _HREF_RE.findall(markup)
+
+    # every <a> with an href should have been matched; if some weren't (e.g. an unclosed <a> swallowing
+    # the next one) the page gets a real parse instead
+    if len(matches) < len(_ANCHOR_RE.findall(markup)):
+        yield from _parse_links_lxml(root, html)
+        return
+
+    for double_quoted, single_quoted, unquoted, text in matches:
+        href = double_quoted or single_quoted or unquoted
         if href:
-            text = link.string
-            if not text:
-                text = ''
-            text = re.sub('\s+', ' ', text).strip()
-            yield (parse.urljoin(root, link.get('href')), text)
-
-def parse_links_sorted(root, html):
-    urls = []
-
-    soup = BeautifulSoup(html, 'html.parser')
-    for link in soup.find_all('a'):
+            text = _TAG_RE.sub(b'', text).decode('utf-8')
+            text = _WS_RE.sub(' ', unescape(text)).strip()
+            yield (parse.urljoin(root, unescape(href.decode('utf-8'))), text)
+
+def _parse_links_lxml(root, html):
+    # only <a> tags are needed, so walk lxml's own tree rather than wrapping every node in BeautifulSoup
+    try:
+        tree = lxml_html.fromstring(html)
+    except etree.ParserError:
+        return # nothing lxml can build a document from, e.g. markup that is all doctype or comment
+    for link in tree.iter('a'):
         href = link.get('href')
         if href:
-            text = link.string
-            if not text:
-                text = ''
-            text = re.sub('\s+', ' ', text).strip()
-            urls.append((parse.urljoin(root, link.get('href')), text))
-
-    urls.sort(reverse=True, key=rank_link)
-    
-    for url in urls:
-        yield(url)
+            text = _WS_RE.sub(' ', link.text_content()).strip()
+            yield (parse.urljoin(root, href), text)
 
 # One of the main metrics used for ranking a link is how many '/' (subdirectories) it 
 # contains. The logic behind this is that the more '/' present, the deeper into a domain
@@ -72,79 +167,65 @@ def parse_links_sorted(root, html):
 def rank_link(link):
     rank = 0 # the higher the rank, the greater the priority to crawl 
 
-    url = link[0]
-    url = strip_http_request(url)
+    url = link[0].split('://', 1)[-1] # the scheme's '//' is not a subdirectory
 
-    num_subdirectories = 0
-    for char in url:
-        if char == '/':
-            num_subdirectories += 1
+    num_subdirectories = url.count('/')
 
     rank = 10 * num_subdirectories + len(link[1])
 
     return rank
 
 def get_links(url):
-    res = request.urlopen(url)
-    return list(parse_links(url, res.read()))
+    res = _SESSION.get(url, timeout=REQUEST_TIMEOUT)
+    res.raise_for_status()
+    return list(parse_links(url, res.content))
 
 def get_nonlocal_links(url):
     '''Get a list of links on the page specificed by the url,
     but only keep non-local links and non self-references.
     Return a list of (link, title) pairs, just like get_links()'''
 
-    stripped_root_link = strip_http_request(url)
+    root_host = parse.urlsplit(url).netloc
 
     links = get_links(url)
-    filtered = []
-
-    for link in links:
-        if is_non_local(link[0], stripped_root_link):
-            filtered.append(link)
-
-    return filtered
-
+    filtered = {} # link -> title; a link repeated on the page (e.g. in a nav bar and footer) is kept once
 
-def is_http_request(url):
-    if len(url) > 8 and url[4] == 's':
-        if url[0:8] == "https://":
-            return True
-    elif len(url) > 7:
-        if url[0:7] == "http://":
-            return True
+    for link, title in links:
+        if link not in filtered and is_non_local(link, root_host):
+            filtered[link] = title
 
-def strip_http_request(url):
-    if is_http_request(url) and url[4] == 's': # an https request
-        return url[8:len(url)]
-    elif is_http_request:
-        return url[7:len(url)]
-    
-    return url # already stripped
+    return list(filtered.items())
 
-def strip_www(url):
-    if len(url) > 4 and url[0] == "w" and url[1] == "w" and url[2] == "w" and url[3] == ".":
-        url = url[4:len(url)]
-    
-    return url
 
+# the same links show up on most pages of a site, so parsing results are memoized
+@functools.lru_cache(maxsize=100_000)
 def get_domain(url):
-    domain = ""
+    hostname = parse.urlsplit(url).hostname
+    return hostname.removeprefix('www.') if hostname else ''
 
-    stripped_url = strip_www(strip_http_request(url))
+@functools.lru_cache(maxsize=100_000)
+def normalize_url(url):
+    '''Return the form of `url` used to tell whether two links point at the same page:
+    the fragment is dropped and the host is lowercased, since neither changes what is fetched'''
+    parts = parse.urlsplit(url)
+    return parts._replace(netloc=parts.netloc.lower(), fragment='').geturl()
 
-    i = 0
-    while i < len(stripped_url) and stripped_url[i] != '/':
-        domain += stripped_url[i]
-        i += 1
+def media_type(content_type):
+    '''Reduce a Content-Type header such as "text/html; charset=UTF-8" to its media type, "text/html"'''
+    if content_type is None:
+        return None
+    return content_type.split(';', 1)[0].strip().lower()
 
-    return domain
+def is_non_local(url, root_host):
+    parts = parse.urlsplit(url)
+    return parts.scheme in _HTTP_SCHEMES and parts.netloc != root_host
 
-def is_non_local(url, stripped_root_link):
-    if is_http_request(url):
-        if strip_http_request(url) != stripped_root_link:
-                return True
-        
-    return False
+
+def _parse_and_extract(url, html):
+    '''Do the CPU-bound work on a fetched page; run in a worker process by crawl().
+    Both steps scan the same raw bytes, so the page is never parsed or decoded as a whole.
+    Return the page's (link, title) pairs and its extracted contact information'''
+    return list(parse_links(url, html)), extract_information(url, html)
 
 
 def crawl(root, wanted_content=[], within_domain=True):
@@ -152,100 +233,134 @@ def crawl(root, wanted_content=[], within_domain=True):
     `wanted_content` is a list of content types to crawl
     `within_domain` specifies whether the crawler should limit itself to the domain of `root`
     '''
+    try:
+        return asyncio.run(_crawl(root, wanted_content, within_domain))
+    finally:
+        # don't hold on to one crawl's urls for the rest of the process
+        get_domain.cache_clear()
+        normalize_url.cache_clear()
+
+
+async def _crawl(root, wanted_content, within_domain):
+    root = normalize_url(root)
     root_domain = get_domain(root)
 
-    queue = Queue()
-    queue.put(root)
+    # the frontier is a heap which always hands out the highest ranked link next (see rank_link);
+    # ranks are negated since heapq pops its smallest entry, and `order` breaks ties first come first served.
+    # Everything runs on the event loop's one thread, so a plain list needs no locking
+    frontier = [(0, 0, root)]
+    order = itertools.count(1)
 
     visited = []
     extracted = []
 
-    content_types = {
-        'text': ["text/html; charset=UTF-8", "text/plain; charset=UTF-8"],
-        'html': ["text/html; charset=UTF-8"],
-        'pdf:': ["application/pdf"],
-        'zip:': ["application/zip"],
-        'jpeg': ["image/jpeg"],
-        'png': ["image/png"],
-        'pptx': ["application/vnd.ms-powerpoint"]
-    }
-
-    while not queue.empty():
-        url = queue.get()
-        try:
-            req = request.urlopen(url)
-            html = req.read()
-            headers = req.headers['Content-Type']
+    # every link ever put on the frontier (which includes everything visited), so a link
+    # found on several pages is still only fetched once
+    links_added_globally = {root}
 
-            if len(wanted_content) > 0: # check if user wanted specific type(s) of content
+    # caps how many requests are in flight to any single host at once
+    host_limits = defaultdict(lambda: asyncio.Semaphore(PER_HOST_CONNECTIONS))
 
-                content_matches = False
-                for content in wanted_content: # if so, determine if one is the same as the req header
-                    for appropriate_header in content_types[content.lower()]:
-                        if appropriate_header == headers:
-                            content_matches = True
+    # every media type the user asked for; empty means anything goes
+    allowed = frozenset().union(*(CONTENT_TYPES[content.lower()] for content in wanted_content))
 
-                if not content_matches:
-                    continue
+    # checked once so disabled loggers don't cost a call per visit and extraction
+    log_visits = visitlog.isEnabledFor(logging.DEBUG)
+    log_extractions = extractlog.isEnabledFor(logging.DEBUG)
 
-            visited.append(url)
-            visitlog.debug(url)
+    # bound once up front instead of being looked up again for every extraction and link
+    extracted_append = extracted.append
+    mark_added = links_added_globally.add
+    push = heapq.heappush
 
-            for ex in extract_information(url, html):
-                extracted.append(ex)
-                extractlog.debug(ex)
+    loop = asyncio.get_running_loop()
 
-            stripped_root_link = strip_http_request(url)
+    async def visit(session, pool, url):
+        try:
+            async with host_limits[parse.urlsplit(url).netloc]:
+                async with session.get(url) as res:
+                    # the headers arrive before the body, so content we don't want is dropped (and the
+                    # connection closed) without downloading it; no separate HEAD request is needed
+                    if allowed and media_type(res.headers.get('Content-Type')) not in allowed:
+                        return
+                    html = await res.read()
+
+            visited.append(url)
+            if log_visits:
+                visitlog.debug(url)
 
-            links_added_to_queue = [] # prevents repeat links being added
+            links, extractions = await loop.run_in_executor(pool, _parse_and_extract, url, html)
 
-            for link, title in parse_links_sorted(url, html):
+            for ex in extractions:
+                extracted_append(ex)
+                if log_extractions:
+                    extractlog.debug(ex)
 
-                if link not in links_added_to_queue:
+            for link, title in links:
+                normalized = normalize_url(link)
 
-                    if is_non_local(link, stripped_root_link):
+                if normalized not in links_added_globally:
 
-                        if link not in visited:
+                    # self-references are already in links_added_globally, so only the scheme needs checking
+                    if parse.urlsplit(normalized).scheme in _HTTP_SCHEMES:
 
-                            if not within_domain or get_domain(link) == root_domain:
-                                links_added_to_queue.append(link)
-                                queue.put(link)
+                        if not within_domain or get_domain(normalized) == root_domain:
+                            mark_added(normalized)
+                            push(frontier, (-rank_link((link, title)), next(order), normalized))
 
         except Exception as e:
             print(e, url)
 
+    # parsing and extraction are CPU-bound, so they run in other processes while the loop keeps fetching
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        # one session for the whole crawl so connections are kept alive and reused between pages;
+        # raise_for_status keeps the old urlopen behaviour of treating 4xx/5xx responses as errors
+        connector = aiohttp.TCPConnector(limit=CRAWL_WORKERS, limit_per_host=PER_HOST_CONNECTIONS)
+        async with aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            raise_for_status=True
+        ) as session:
+            in_flight = set()
+
+            # keep up to CRAWL_WORKERS pages in progress; whenever one finishes, the links it found
+            # are on the frontier and the next best ones are started
+            while frontier or in_flight:
+                while frontier and len(in_flight) < CRAWL_WORKERS:
+                    _, _, url = heapq.heappop(frontier)
+                    in_flight.add(asyncio.create_task(visit(session, pool, url)))
+
+                _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
     return visited, extracted
 
 
 def extract_information(address, html):
     '''Extract contact information from html, returning a list of (url, category, content) pairs,
     where category is one of PHONE, ADDRESS, EMAIL'''
-    html = BeautifulSoup(html, "html.parser")
+    # the patterns don't depend on the page's structure, so match against the raw markup
+    # (which also catches addresses in attributes such as mailto: links) instead of parsing it
+    if isinstance(html, str):
+        html = html.encode('utf-8')
 
     results = []
 
-    for match in re.findall('\d\d\d-\d\d\d-\d\d\d\d', str(html)):
-        results.append((address, 'PHONE', match))
-    
-    # account for other formating
-    for match in re.findall('\(\d\d\d\) \d\d\d-\d\d\d\d', str(html)):
-        results.append((address, 'PHONE', match))
-    
-    # hypens, periods, and underscores are all valid special characters besides alphanumerics for an email's username and domain; 
-    # domain extension must contain a '.' followed by a 2-3 digit long sequence, e.g., '.us' '.edu' '
-    for match in re.findall('([a-zA-Z0-9_\-\.]+@[a-zA-Z0-9_\-\.]+\.[a-zA-Z]{2,3})', str(html)): 
-        results.append((address, 'EMAIL', match))
-
-    for match in re.findall('[a-zA-Z]+ ?[a-zA-z]+?, [a-zA-Z.]+ [0-9]{5}', str(html)):
-        results.append((address, 'ADDRESS', match))
+    for match in _CONTACT.finditer(html):
+        # every pattern only matches ASCII characters
+        results.append((address, _CONTACT_CATEGORIES[match.lastindex], match.group().decode('ascii')))
 
     return results
 
 
 def writelines(filename, data):
-    with open(filename, 'w') as fout:
-        for d in data:
-            print(d, file=fout)
+    lines = map(str, data)
+    with open(filename, 'w', buffering=1 << 20) as fout:
+        # join and write in blocks of lines rather than printing each one, without
+        # building the whole file in memory at once
+        while chunk := list(itertools.islice(lines, 65536)):
+            fout.write('\n'.join(chunk))
+            fout.write('\n')
 
 
 def main():